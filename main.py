@@ -1,39 +1,197 @@
+import asyncio
+import functools
+import hashlib
 import os
 import logging
-import json
+import re
+import secrets
+from contextlib import contextmanager
+from pathlib import Path
+
+import cachetools
+import numpy as np
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import pandas as pd
 
 from telegram import (
     Update,
 )
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     ContextTypes,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 # ── LOGGING ──────────────────────────────────────────────────────────────────────
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# Log-Level per Env steuerbar, damit Produktion z.B. auf WARNING heben kann
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+
+# ── KONFIGURATION AUS DER UMGEBUNG (einmalig beim Import gelesen) ───────────────
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+APP_URL = os.getenv("APP_URL")  # z.B. "https://mein-bot.onrender.com"
 
 # ── POSTGRES-DB: VERBINDUNG UND FUNKTIONEN ──────────────────────────────────────
 
-def get_db_connection():
+# Aktuelle Schema-Version; bei Schema-Änderungen in init_db() hochzählen
+SCHEMA_VERSION = 1
+
+# Wird einmalig in main() über init_pool() befüllt
+_POOL: psycopg2.pool.ThreadedConnectionPool | None = None
+
+class _PoolConnection(psycopg2.extensions.connection):
+    """
+    Pool-Verbindung mit Flags für die einmalige Initialisierung. Der Pool
+    schließt überzählige Verbindungen bei der Rückgabe und baut neue auf —
+    die Flags hängen daher an der Verbindung selbst, nicht an einem
+    prozessweiten Set von id(conn)-Werten, das neu vergebene Adressen
+    fälschlich als initialisiert einstufen würde.
+    """
+
+    # Klassen-Defaults; pro Verbindung per Zuweisung überschrieben
+    session_ready = False
+    prepared = False
+
+def init_pool() -> None:
     """
-    Baut eine psycopg2-Verbindung zur Render-Postgres-DB 
+    Baut einmalig einen Verbindungspool zur Render-Postgres-DB
     anhand der Environment-Variable DATABASE_URL auf.
     """
+    global _POOL
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
         raise RuntimeError("Environment-Variable DATABASE_URL ist nicht gesetzt")
-    conn = psycopg2.connect(dsn=database_url, cursor_factory=psycopg2.extras.DictCursor)
-    return conn
+    _POOL = psycopg2.pool.ThreadedConnectionPool(
+        minconn=2,
+        maxconn=10,
+        dsn=database_url,
+        connection_factory=_PoolConnection,
+        cursor_factory=psycopg2.extras.DictCursor,
+    )
+    logger.info("Postgres-Verbindungspool eingerichtet (2-10 Verbindungen).")
+
+def _init_session(conn) -> None:
+    """
+    Einmalige Session-Einstellungen pro Pool-Verbindung. synchronous_commit
+    OFF lässt Commits ohne WAL-Flush-Wartezeit zurückkehren; bei einem
+    Server-Crash gehen schlimmstenfalls die letzten Millisekunden an
+    Rankings verloren, die Nutzer einfach erneut senden können.
+    """
+    if conn.session_ready:
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SET synchronous_commit TO OFF;")
+    conn.commit()
+    conn.session_ready = True
+
+@contextmanager
+def db_conn():
+    """
+    Gibt eine Verbindung aus dem Pool aus, committet bei Erfolg,
+    rollt bei Fehlern zurück und legt die Verbindung danach zurück
+    in den Pool (statt sie zu schließen).
+    """
+    if _POOL is None:
+        raise RuntimeError("Verbindungspool nicht initialisiert — init_pool() wurde nicht aufgerufen")
+    conn = _POOL.getconn()
+    try:
+        _init_session(conn)
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _POOL.putconn(conn)
+
+# Statements, die auf jeder Pool-Verbindung einmalig vorbereitet werden;
+# danach kostet jeder Aufruf nur noch Bind+Execute statt Parse+Plan.
+_PREPARE_STATEMENTS = (
+    """
+    PREPARE ups_profile (bigint, text, text, text) AS
+    INSERT INTO user_state (chat_id, first_name, last_name, username, selected, ranking)
+    VALUES ($1, $2, $3, $4, NULL, NULL)
+    ON CONFLICT (chat_id) DO UPDATE
+      SET first_name = EXCLUDED.first_name,
+          last_name  = EXCLUDED.last_name,
+          username   = EXCLUDED.username
+    """,
+    """
+    PREPARE del_selection (bigint) AS
+    UPDATE user_state
+    SET selected = NULL, ranking = NULL
+    WHERE chat_id = $1
+    """,
+)
+
+def _ensure_prepared(conn) -> None:
+    """
+    Bereitet die Statements auf dieser Verbindung vor, falls noch nicht
+    geschehen.
+    """
+    if conn.prepared:
+        return
+    with conn.cursor() as cursor:
+        for stmt in _PREPARE_STATEMENTS:
+            cursor.execute(stmt)
+    conn.prepared = True
+
+def with_conn(fn):
+    """
+    Dekorator für die DB-Schicht: checkt eine Pool-Verbindung aus, stellt
+    die vorbereiteten Statements sicher und reicht die Verbindung als
+    erstes Argument an die Funktion durch. Commit/Rollback/Rückgabe
+    übernimmt db_conn().
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with db_conn() as conn:
+            _ensure_prepared(conn)
+            return fn(conn, *args, **kwargs)
+    return wrapper
+
+async def close_pool(app) -> None:
+    """
+    post_shutdown-Hook: beendet zuerst den Writer-Task geordnet, schreibt
+    dann noch anstehende Ranking-Upserts und schließt zuletzt alle
+    Pool-Verbindungen sauber.
+    """
+    global _WRITE_QUEUE, _WRITER_TASK
+    if _WRITER_TASK is not None:
+        # Sentinel statt cancel(): der Task schreibt einen laufenden Flush
+        # zu Ende und arbeitet die Queue in Reihenfolge ab, bevor er endet.
+        # Cancel nur als Notbremse, falls die DB beim Shutdown hängt.
+        _WRITE_QUEUE.put_nowait(None)
+        try:
+            await asyncio.wait_for(_WRITER_TASK, timeout=10)
+        except asyncio.TimeoutError:
+            _WRITER_TASK.cancel()
+            try:
+                await _WRITER_TASK
+            except asyncio.CancelledError:
+                pass
+        _WRITER_TASK = None
+        _WRITE_QUEUE = None  # späte Writes fallen auf den Direkt-Write zurück
+    if _PENDING_WRITES:
+        remaining = list(_PENDING_WRITES.values())
+        _PENDING_WRITES.clear()
+        try:
+            await asyncio.to_thread(_flush_rankings, remaining)
+        except Exception:
+            logger.exception("Rest-Flush beim Shutdown fehlgeschlagen (%s Einträge).", len(remaining))
+    if _POOL is not None:
+        _POOL.closeall()
+        logger.info("Postgres-Verbindungspool geschlossen.")
 
 def init_db() -> None:
     """
@@ -45,122 +203,385 @@ def init_db() -> None:
       - first_name TEXT
       - last_name  TEXT
       - username   TEXT
-      - selected   TEXT    (JSON-Array von game_ids)
-      - ranking    TEXT    (JSON-Array von game_ids)
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 1. Tabelle anlegen, falls sie nicht existiert, mit allen Spalten
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_state (
-            chat_id    BIGINT PRIMARY KEY
-          , first_name TEXT
-          , last_name  TEXT
-          , username   TEXT
-          , selected   TEXT
-          , ranking    TEXT
-        );
-        """
-    )
-
-    # 2. Spalten ergänzen, falls sie in älterer Struktur fehlen
-    alter_statements = [
-        "ALTER TABLE user_state ADD COLUMN IF NOT EXISTS first_name TEXT;",
-        "ALTER TABLE user_state ADD COLUMN IF NOT EXISTS last_name TEXT;",
-        "ALTER TABLE user_state ADD COLUMN IF NOT EXISTS username TEXT;",
-        "ALTER TABLE user_state ADD COLUMN IF NOT EXISTS selected TEXT;",
-        "ALTER TABLE user_state ADD COLUMN IF NOT EXISTS ranking TEXT;"
-    ]
-    for stmt in alter_statements:
-        cursor.execute(stmt)
+      - selected   INTEGER[] (game_ids in Auswahlreihenfolge)
+      - ranking    INTEGER[] (game_ids in Rangfolge)
+    """
+    with db_conn() as conn:
+        with conn.cursor() as cursor:
+            # 0. Versionstabelle: steht dort bereits >= SCHEMA_VERSION,
+            #    entfällt der komplette Migrationsblock (und damit die
+            #    AccessExclusiveLocks der ALTERs bei jedem Cold-Start).
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (v INT NOT NULL);")
+            cursor.execute("SELECT MAX(v) FROM schema_version;")
+            version = cursor.fetchone()[0] or 0
+            if version >= SCHEMA_VERSION:
+                logger.info("Postgres-Schema bereits auf Version %s, Migration übersprungen.", version)
+                return
+
+            # 1. Tabelle anlegen, falls sie nicht existiert, mit allen Spalten
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_state (
+                    chat_id    BIGINT PRIMARY KEY
+                  , first_name TEXT
+                  , last_name  TEXT
+                  , username   TEXT
+                  , selected   INTEGER[]
+                  , ranking    INTEGER[]
+                );
+                """
+            )
 
-    conn.commit()
-    conn.close()
-    logger.info("Postgres-Tabelle user_state ist eingerichtet (inkl. aller Spalten).")
+            # 2. Spalten ergänzen, falls sie in älterer Struktur fehlen
+            #    (ein ALTER mit allen Spalten = ein Katalog-Roundtrip)
+            cursor.execute(
+                """
+                ALTER TABLE user_state
+                    ADD COLUMN IF NOT EXISTS first_name TEXT,
+                    ADD COLUMN IF NOT EXISTS last_name  TEXT,
+                    ADD COLUMN IF NOT EXISTS username   TEXT,
+                    ADD COLUMN IF NOT EXISTS selected   INTEGER[],
+                    ADD COLUMN IF NOT EXISTS ranking    INTEGER[];
+                """
+            )
 
-def save_profile(chat_id: int, first_name: str, last_name: str, username: str) -> None:
+            # 3. Alt-Bestände: TEXT-JSON-Spalten auf native integer[] umstellen.
+            #    Postgres erlaubt in der USING-Klausel eines ALTER COLUMN keine
+            #    Subquery ("cannot use subquery in transform expression"), daher
+            #    über eine neue Spalte + UPDATE + Drop/Rename konvertieren; die
+            #    Spaltenreihenfolge ändert sich dabei, alle Queries nennen ihre
+            #    Spalten aber ohnehin explizit.
+            cursor.execute(
+                """
+                SELECT column_name FROM information_schema.columns
+                WHERE table_name = 'user_state'
+                  AND column_name IN ('selected', 'ranking')
+                  AND data_type = 'text'
+                """
+            )
+            for row in cursor.fetchall():
+                column = row[0]
+                cursor.execute(f"ALTER TABLE user_state ADD COLUMN {column}_arr integer[];")
+                cursor.execute(
+                    f"""
+                    UPDATE user_state
+                    SET {column}_arr = (SELECT array_agg(x::int)
+                                        FROM jsonb_array_elements_text({column}::jsonb) AS t(x))
+                    WHERE {column} IS NOT NULL;
+                    """
+                )
+                cursor.execute(f"ALTER TABLE user_state DROP COLUMN {column};")
+                cursor.execute(f"ALTER TABLE user_state RENAME COLUMN {column}_arr TO {column};")
+
+            # 4. Version festschreiben; läuft in derselben Transaktion wie
+            #    die Migration selbst
+            cursor.execute("DELETE FROM schema_version;")
+            cursor.execute("INSERT INTO schema_version (v) VALUES (%s);", (SCHEMA_VERSION,))
+
+    logger.info("Postgres-Tabelle user_state ist eingerichtet (Schema-Version %s).", SCHEMA_VERSION)
+
+@with_conn
+def save_profile(conn, chat_id: int, first_name: str, last_name: str, username: str) -> None:
     """
     Speichert oder aktualisiert Profil-Daten in Postgres.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO user_state (chat_id, first_name, last_name, username, selected, ranking)
-        VALUES (%s, %s, %s, %s, NULL, NULL)
-        ON CONFLICT (chat_id) DO UPDATE
-          SET first_name = EXCLUDED.first_name,
-              last_name  = EXCLUDED.last_name,
-              username   = EXCLUDED.username
-        """,
-        (chat_id, first_name, last_name, username),
-    )
-    conn.commit()
-    conn.close()
-    logger.info(f"[DB] Profil gespeichert: chat_id={chat_id}, {first_name} {last_name}, @{username}")
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "EXECUTE ups_profile (%s, %s, %s, %s)",
+            (chat_id, first_name, last_name, username),
+        )
+    logger.debug("[DB] Profil gespeichert: chat_id=%s, %s %s, @%s", chat_id, first_name, last_name, username)
 
-def save_selected_and_ranking(chat_id: int, ids: list[int]) -> None:
+@with_conn
+def save_selected_and_ranking(conn, chat_id: int, ids: list[int]) -> None:
     """
-    Speichert oder aktualisiert in Postgres die Spalten 'selected' und 'ranking' 
-    für diesen chat_id. Beides ist identisch, da die vom Nutzer gesendete Reihenfolge 
+    Speichert oder aktualisiert in Postgres die Spalten 'selected' und 'ranking'
+    für diesen chat_id. Beides ist identisch, da die vom Nutzer gesendete Reihenfolge
     zugleich die Rangfolge ist.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    json_ids = json.dumps(ids, ensure_ascii=False)
-
-    cursor.execute(
-        """
-        INSERT INTO user_state (chat_id, first_name, last_name, username, selected, ranking)
-        VALUES (%s, NULL, NULL, NULL, %s, %s)
-        ON CONFLICT (chat_id) DO UPDATE
-          SET selected = EXCLUDED.selected,
-              ranking  = EXCLUDED.ranking
-        """,
-        (chat_id, json_ids, json_ids),
-    )
-    conn.commit()
-    conn.close()
-    logger.info(f"[DB] Ausgewählte IDs und Ranking gespeichert für chat_id={chat_id}: {ids}")
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO user_state (chat_id, first_name, last_name, username, selected, ranking)
+            VALUES (%s, NULL, NULL, NULL, %s, %s)
+            ON CONFLICT (chat_id) DO UPDATE
+              SET selected = EXCLUDED.selected,
+                  ranking  = EXCLUDED.ranking
+            """,
+            (chat_id, ids, ids),
+        )
+    logger.debug("[DB] Ausgewählte IDs und Ranking gespeichert für chat_id=%s: %s", chat_id, ids)
+
+# ── GEBÜNDELTE RANKING-SCHREIBVORGÄNGE ──────────────────────────────────────────
+
+# Warteschlange der chat_ids mit ausstehendem Upsert (angelegt in
+# start_write_worker); die eigentlichen Daten liegen in _PENDING_WRITES,
+# sodass schnelle Mehrfach-Submissions desselben Chats vor dem Flush
+# zu einem einzigen Write zusammenfallen (last wins).
+_WRITE_QUEUE: asyncio.Queue | None = None
+_WRITER_TASK: asyncio.Task | None = None
+_PENDING_WRITES: dict[int, tuple[int, list[int] | None, list[int] | None]] = {}
+_FLUSH_BATCH = 100      # max. Upserts pro Batch
+_FLUSH_WAIT = 0.05      # Sekunden, die auf weitere Upserts gewartet wird
+
+def _flush_rankings(items: list[tuple[int, list[int] | None, list[int] | None]]) -> None:
+    """
+    Schreibt eine Liste von (chat_id, selected, ranking)-Tupeln in einem
+    einzigen execute_values-Upsert; None-Listen stehen für eine Löschung
+    und werden als NULL geschrieben. Pro chat_id gewinnt der letzte
+    Eintrag, da ON CONFLICT dieselbe Zeile nicht zweimal in einem
+    Statement aktualisieren darf.
+    """
+    latest: dict[int, tuple[int, list[int] | None, list[int] | None]] = {}
+    for item in items:
+        latest[item[0]] = item
+
+    with db_conn() as conn:
+        with conn.cursor() as cursor:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO user_state (chat_id, selected, ranking)
+                VALUES %s
+                ON CONFLICT (chat_id) DO UPDATE
+                  SET selected = EXCLUDED.selected,
+                      ranking  = EXCLUDED.ranking
+                """,
+                list(latest.values()),
+                page_size=_FLUSH_BATCH,
+            )
+    logger.debug("[DB] %s Ranking-Upsert(s) gebündelt geschrieben.", len(latest))
+
+async def _ranking_writer() -> None:
+    """
+    Hintergrund-Task: sammelt Upserts aus der Queue (bis _FLUSH_BATCH Stück
+    bzw. _FLUSH_WAIT Sekunden) und schreibt sie als einen Batch. Ein None
+    in der Queue (Sentinel aus close_pool) beendet den Task nach dem
+    laufenden Batch.
+    """
+    stop = False
+    while not stop:
+        got = await _WRITE_QUEUE.get()
+        if got is None:
+            _WRITE_QUEUE.task_done()
+            break
+        chat_ids = [got]
+        try:
+            while len(chat_ids) < _FLUSH_BATCH:
+                got = await asyncio.wait_for(_WRITE_QUEUE.get(), timeout=_FLUSH_WAIT)
+                if got is None:
+                    _WRITE_QUEUE.task_done()
+                    stop = True
+                    break
+                chat_ids.append(got)
+        except asyncio.TimeoutError:
+            pass
+        # Daten erst jetzt aus _PENDING_WRITES nehmen: bis hierher ersetzen
+        # neue Submissions desselben Chats nur den ausstehenden Eintrag
+        items = [
+            _PENDING_WRITES.pop(cid)
+            for cid in chat_ids
+            if cid in _PENDING_WRITES
+        ]
+        try:
+            if items:
+                await asyncio.to_thread(_flush_rankings, items)
+        except Exception:
+            logger.exception("Gebündelter Ranking-Upsert fehlgeschlagen (%s Einträge).", len(items))
+        finally:
+            for _ in chat_ids:
+                _WRITE_QUEUE.task_done()
+
+async def start_write_worker(app) -> None:
+    """
+    post_init-Hook: legt die Queue an und startet den Writer-Task. Der
+    Task läuft bewusst außerhalb der PTB-Task-Verwaltung (app.create_task
+    warnt vor dem Start der Application und würde den Task nicht awaiten);
+    close_pool beendet ihn über das Handle geordnet.
+    """
+    global _WRITE_QUEUE, _WRITER_TASK
+    _WRITE_QUEUE = asyncio.Queue()
+    _WRITER_TASK = asyncio.create_task(_ranking_writer())
+
+async def queue_selected_and_ranking(chat_id: int, ids: list[int]) -> None:
+    """
+    Reiht einen Ranking-Upsert in die Schreib-Queue ein; fällt auf den
+    direkten Einzel-Write zurück, solange der Worker noch nicht läuft.
+    """
+    if _WRITE_QUEUE is None:
+        await asyncio.to_thread(save_selected_and_ranking, chat_id, ids)
+        return
+    already_queued = chat_id in _PENDING_WRITES
+    _PENDING_WRITES[chat_id] = (chat_id, ids, ids)
+    if not already_queued:
+        await _WRITE_QUEUE.put(chat_id)
+
+async def queue_clear_selection(chat_id: int) -> None:
+    """
+    Reiht eine Löschung in dieselbe Schreib-Queue ein wie die Upserts,
+    damit Writes pro Chat in Reihenfolge bleiben: Ein direkter DELETE
+    würde von einem noch ausstehenden Ranking-Flush überschrieben.
+    """
+    if _WRITE_QUEUE is None:
+        await asyncio.to_thread(clear_selection, chat_id)
+        return
+    already_queued = chat_id in _PENDING_WRITES
+    _PENDING_WRITES[chat_id] = (chat_id, None, None)
+    if not already_queued:
+        await _WRITE_QUEUE.put(chat_id)
+
+# Kurzlebiger Prozess-Cache für Rankings: hält /current nach einem Neustart
+# funktionsfähig, ohne pro Aufruf die DB zu fragen
+_RANKING_CACHE: cachetools.TTLCache = cachetools.TTLCache(maxsize=10_000, ttl=3600)
+
+# Zuletzt gespeicherte Profildaten pro chat_id; wiederholtes /start ohne
+# Namensänderung spart sich damit den Upsert
+_PROFILE_CACHE: cachetools.TTLCache = cachetools.TTLCache(maxsize=10_000, ttl=3600)
+
+@with_conn
+def load_state(conn, chat_id: int) -> tuple[list[int], list[int]]:
+    """
+    Liest 'selected' und 'ranking' für diesen chat_id in einer einzigen
+    Abfrage aus Postgres (leere Listen, falls nichts gespeichert ist).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT selected, ranking FROM user_state WHERE chat_id = %s LIMIT 1",
+            (chat_id,),
+        )
+        row = cursor.fetchone()
+    if not row:
+        return [], []
+    selected = list(row["selected"]) if row["selected"] else []
+    ranking = list(row["ranking"]) if row["ranking"] else []
+    return selected, ranking
+
+async def get_ranking(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> list[int]:
+    """
+    Gibt das Ranking aus user_data bzw. dem TTL-Cache zurück und fällt
+    nur bei einem Miss (z.B. nach Neustart) auf die DB zurück; dabei wird
+    user_data gleich mit dem kompletten Zustand befüllt.
+    """
+    rank_ids = context.user_data.get("ranking_ids")
+    if rank_ids is not None:
+        return rank_ids
+    rank_ids = _RANKING_CACHE.get(chat_id)
+    if rank_ids is None:
+        selected, rank_ids = await asyncio.to_thread(load_state, chat_id)
+        _RANKING_CACHE[chat_id] = rank_ids
+        context.user_data["selected_ids"] = selected
+        context.user_data["ranking_ids"] = rank_ids
+    return rank_ids
+
+@with_conn
+def clear_selection(conn, chat_id: int) -> None:
+    """
+    Setzt 'selected' und 'ranking' für diesen chat_id in Postgres zurück.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("EXECUTE del_selection (%s)", (chat_id,))
 
 
 # ── EXCEL EINLESEN UND BEREINIGEN ────────────────────────────────────────────────
 
+# Bei Änderungen an der Bereinigungslogik hochzählen, damit alte
+# Cache-Sidecars nicht weiterverwendet werden
+_LOADER_VERSION = 2
+
 def load_games_from_excel(path: str) -> pd.DataFrame:
     """
     Liest die Excel-Datei ein und gibt einen DataFrame mit Spalten:
     [game_id, game_name, price]. Spiel-IDs sind fortlaufend ab 1.
+
+    Der bereinigte DataFrame wird als Pickle-Sidecar unter .cache/
+    abgelegt, geschlüsselt über den SHA-256 der xlsx-Datei. Solange
+    die Datei unverändert ist, überspringen Folge-Starts das langsame
+    openpyxl-Parsing komplett.
     """
-    df_raw = pd.read_excel(path, header=None)
-    df_clean = df_raw.dropna(subset=[1]).loc[:, [1, 2]].copy()
-    df_clean.columns = ["game_name", "price"]
-    df_clean.insert(0, "game_id", range(1, len(df_clean) + 1))
+    with open(path, "rb") as fh:
+        digest = hashlib.sha256(fh.read()).hexdigest()[:16]
+    cache_path = Path(".cache") / f"games-v{_LOADER_VERSION}-{digest}.pkl"
+    if cache_path.exists():
+        return pd.read_pickle(cache_path)
+
+    # Nur die zwei benötigten Spalten einlesen und direkt typisieren —
+    # eine Materialisierung statt Einlesen/Slicen/Umcasten in vier Schritten
+    df_clean = (
+        pd.read_excel(path, header=None, usecols=[1, 2], names=["game_name", "price"])
+        .dropna(subset=["game_name"])
+        .reset_index(drop=True)
+    )
     df_clean["game_name"] = df_clean["game_name"].astype(str)
     df_clean["price"] = df_clean["price"].astype(float)
+    df_clean.insert(0, "game_id", np.arange(1, len(df_clean) + 1, dtype="int64"))
+
+    cache_path.parent.mkdir(exist_ok=True)
+    df_clean.to_pickle(cache_path)
     return df_clean
 
+# Einmalig kompiliertes Muster zum Extrahieren der Spiel-IDs aus Nachrichten
+_ID_RE = re.compile(r"\d+")
+
+# Statischer Teil der /start-Nachricht, einmalig beim Import aufgebaut
+_START_TEXT_TAIL = (
+    "Ich habe dein Profil gespeichert.\n\n"
+    "📋 Befehle:\n"
+    "`/games` – Zeigt die Spieleliste\n"
+    "`/current` – Zeigt deine aktuelle Auswahl\n"
+    "`/delete` – Löscht deine aktuelle Auswahl\n\n"
+    "📨 Sende eine kommaseparierte Liste von IDs, um deine Favoriten anzugeben.\n"
+    "Beispiel: `1,5,10` – ID 1 ist dein Favorit, dann ID 5, dann ID 10."
+)
+
+# Statische Kopf-/Fußteile der Bestätigungs- und /current-Nachrichten
+_CONFIRM_HEAD = "✅ Deine Auswahl (in Prioritätsreihenfolge):\n"
+_CONFIRM_TAIL = (
+    "\n\n"
+    "Wenn du erneut eine andere Reihenfolge senden möchtest, schicke einfach erneut die IDs."
+)
+_CURRENT_HEAD = "🎮 Deine aktuelle Prioritätenliste:\n"
+_CURRENT_TAIL = (
+    "\n\n"
+    "Um sie zu ändern, sende einfach erneut deine ID-Liste."
+)
+
 # Excel-Datei beim Start laden (Pfad anpassen, falls nötig)
 GAMES_DF = load_games_from_excel("SpieleMitPreisenIDs.xlsx")
 NUM_PER_PAGE = 10  # Anzahl Spiele pro Seite, kann angepasst werden
 MAX_PAGE = (len(GAMES_DF) - 1) // NUM_PER_PAGE + 1  # Gesamtzahl der Seiten
+VALID_IDS = frozenset(range(1, len(GAMES_DF) + 1))  # gültige Spiel-IDs, O(1)-Membership
+
+# Direkt-Lookups statt DataFrame-Scans pro ID in den Handlern
+GAME_NAME_BY_ID: dict[int, str] = dict(zip(GAMES_DF["game_id"].astype(int), GAMES_DF["game_name"]))
+GAME_PRICE_BY_ID: dict[int, float] = dict(zip(GAMES_DF["game_id"].astype(int), GAMES_DF["price"]))
 
 # ── HILFSFUNKTION: SPIELELISTE ALS TEXT ──────────────────────────────────────────
 
+def _build_game_lines() -> list[str]:
+    """
+    Baut die formatierten Zeilen "ID. Name — Preis€" einmalig
+    aus dem DataFrame auf.
+    """
+    slice_df = GAMES_DF.iloc[0:MAX_PAGE*NUM_PER_PAGE]
+
+    gids = slice_df["game_id"].to_numpy()
+    names = slice_df["game_name"].to_numpy()
+    prices = slice_df["price"].to_numpy()
+    return [
+        f"{int(gid)}. {name} — {float(price):.2f}€"
+        for gid, name, price in zip(gids, names, prices)
+    ]
+
+# Zeilen einmal beim Import formatieren; der Katalog ändert sich zur Laufzeit nicht
+_GAME_LINES = _build_game_lines()
+
 def format_games_page() -> str:
     """
     Gibt einen Textblock zurück mit den Spielen und Preisen
     für die angegebene Seite (1-basiert).
     """
-    slice_df = GAMES_DF.iloc[0:MAX_PAGE*NUM_PER_PAGE]
-
     lines = ["Eine Liste aller Spiele inklusive Bildern gibt es auch hier mit dem passwort spielespaß: https://nextcloud.hpi.de/s/HRo3qcRexPCS3TS \n"]
-    for _, row in slice_df.iterrows():
-        gid = int(row["game_id"])
-        name = row["game_name"]
-        price = float(row["price"])
-        lines.append(f"{gid}. {name} — {price:.2f}€")
+    lines.extend(_GAME_LINES)
     lines.append(
         "\n"
         "Sende eine Kommaseparierte Liste von IDs in der Reihenfolge, in der du die Spiele bevorzugst.\n"
@@ -168,9 +589,20 @@ def format_games_page() -> str:
     )
     return "\n".join(lines)
 
+# Fertigen Seitentext einmalig zusammensetzen; /games verschickt nur noch die Konstante
+GAMES_PAGE_TEXT = format_games_page()
+
 
 # ── HANDLER ──────────────────────────────────────────────────────────────────────
 
+def send_in_background(context: ContextTypes.DEFAULT_TYPE, **send_kwargs) -> None:
+    """
+    Verschickt eine Nachricht als Hintergrund-Task, damit der Handler nicht
+    auf den Telegram-Roundtrip wartet. Fehler landen im PTB-Error-Handling
+    des Tasks bzw. im Log.
+    """
+    context.application.create_task(context.bot.send_message(**send_kwargs))
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     /start: Profil speichern, initiale Erinnerung senden.
@@ -185,19 +617,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # In-memory initialisieren
     context.user_data.clear()
 
-    # Profil in DB speichern
-    save_profile(chat_id, first_name, last_name, username)
+    # Profil in DB speichern (im Thread, damit der Event-Loop frei bleibt);
+    # unverändertes /start-Spammen löst keinen erneuten Upsert aus
+    profile = (first_name, last_name, username)
+    if _PROFILE_CACHE.get(chat_id) != profile:
+        await asyncio.to_thread(save_profile, chat_id, first_name, last_name, username)
+        _PROFILE_CACHE[chat_id] = profile
 
-    text = (
-    f"👋 Willkommen, {first_name}!\n\n"
-    "Ich habe dein Profil gespeichert.\n\n"
-    "📋 Befehle:\n"
-    "`/games` – Zeigt die Spieleliste\n"
-    "`/current` – Zeigt deine aktuelle Auswahl\n"
-    "`/delete` – Löscht deine aktuelle Auswahl\n\n"
-    "📨 Sende eine kommaseparierte Liste von IDs, um deine Favoriten anzugeben.\n"
-    "Beispiel: `1,5,10` – ID 1 ist dein Favorit, dann ID 5, dann ID 10."
-    )
+    text = f"👋 Willkommen, {first_name}!\n\n" + _START_TEXT_TAIL
     await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
 
 async def delete_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -206,21 +633,19 @@ async def delete_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     """
     chat_id = update.effective_chat.id
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        UPDATE user_state
-        SET selected = NULL, ranking = NULL
-        WHERE chat_id = %s
-        """,
-        (chat_id,),
-    )
-    conn.commit()
-    conn.close()
+    # Wiederholtes /delete ohne zwischenzeitliche Auswahl spart sich den
+    # DB-Roundtrip; nach einem Neustart ist der Merker leer und es wird
+    # sicherheitshalber gelöscht.
+    if context.user_data.get("selection_cleared"):
+        await context.bot.send_message(chat_id=chat_id, text="🗑️ Deine Auswahl ist bereits gelöscht.")
+        return
+
+    await queue_clear_selection(chat_id)
 
     context.user_data.pop("selected_ids", None)
     context.user_data.pop("ranking_ids", None)
+    context.user_data["selection_cleared"] = True
+    _RANKING_CACHE[chat_id] = []
 
     await context.bot.send_message(chat_id=chat_id, text="🗑️ Deine Auswahl wurde gelöscht.")
 
@@ -231,8 +656,7 @@ async def list_games(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     """
     chat_id = update.effective_chat.id
 
-    text = format_games_page()
-    await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+    await context.bot.send_message(chat_id=chat_id, text=GAMES_PAGE_TEXT, parse_mode="Markdown")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -244,42 +668,66 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     chat_id = update.effective_chat.id
     text = update.message.text.strip()
 
-    # IDs extrahieren (Komma-getrennt, nur Ziffern)
-    parts = [p.strip() for p in text.split(",") if p.strip().isdigit()]
-    if not parts:
+    # IDs extrahieren (ein Regex-Durchlauf statt split/strip/isdigit pro Teil).
+    # Der Handler ist hinter filters.Regex(_ID_RE) registriert, die Nachricht
+    # enthält also garantiert mindestens eine Zahl.
+    ids = [int(m) for m in _ID_RE.findall(text)]
+    # IDs validieren (müssen innerhalb 1..len(GAMES_DF) liegen); alle
+    # ungültigen IDs in einer einzigen Antwort melden statt nur der ersten
+    bad = [gid for gid in ids if gid not in VALID_IDS]
+    if bad:
         await context.bot.send_message(
             chat_id=chat_id,
-            text="Ich konnte keine gültigen IDs erkennen. Bitte sende etwas wie `1,5,10`.",
+            text=(
+                f"Ungültige ID(s): {', '.join(map(str, bad))}. "
+                f"Bitte wähle IDs zwischen 1 und {len(GAMES_DF)}."
+            ),
         )
         return
 
-    ids = [int(p) for p in parts]
-    # IDs validieren (müssen innerhalb 1..len(GAMES_DF) liegen)
+    # Duplikate in einem Durchlauf über eine Bitmaske erkennen
+    seen_mask = 0
     for gid in ids:
-        if gid < 1 or gid > len(GAMES_DF):
+        bit = 1 << gid
+        if seen_mask & bit:
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=f"Ungültige ID {gid}. Bitte wähle IDs zwischen 1 und {len(GAMES_DF)}."
+                text=f"Die ID {gid} kommt mehrfach vor. Bitte sende jede ID höchstens einmal."
             )
             return
-
-    # Speicherung: ausgewählte IDs und Ranking identisch
-    save_selected_and_ranking(chat_id, ids)
-    context.user_data["selected_ids"] = ids
-    context.user_data["ranking_ids"] = ids
+        seen_mask |= bit
+
+    # Speicherung: ausgewählte IDs und Ranking identisch.
+    # Unveränderte Wiederholungen lösen keinen DB-Roundtrip aus.
+    if ids != context.user_data.get("ranking_ids"):
+        await queue_selected_and_ranking(chat_id, ids)
+        context.user_data["selected_ids"] = ids
+        context.user_data["ranking_ids"] = ids
+        context.user_data["selection_cleared"] = False
+        # Write-through statt Invalidierung: der nächste Cache-Hit spart
+        # sich den DB-Roundtrip
+        _RANKING_CACHE[chat_id] = ids
 
     # Bestätigung mit Spielnamen
-    names = [
-        GAMES_DF.loc[GAMES_DF["game_id"] == gid, "game_name"].values[0]
-        for gid in ids
-    ]
+    names = [GAME_NAME_BY_ID[gid] for gid in ids]
     text_resp = (
-        "✅ Deine Auswahl (in Prioritätsreihenfolge):\n"
+        _CONFIRM_HEAD
         + "\n".join(f"{i+1}. {names[i]}" for i in range(len(names)))
-        + "\n\n"
-        "Wenn du erneut eine andere Reihenfolge senden möchtest, schicke einfach erneut die IDs."
+        + _CONFIRM_TAIL
+    )
+    # DB-Arbeit ist erledigt; auf den Versand muss der Handler nicht warten
+    send_in_background(context, chat_id=chat_id, text=text_resp)
+
+
+async def handle_unrecognized(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Fängt Textnachrichten ohne einzige Zahl ab (vom Dispatcher über den
+    Regex-Filter aussortiert) und schickt den Eingabehinweis.
+    """
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Ich konnte keine gültigen IDs erkennen. Bitte sende etwas wie 1,5,10.",
     )
-    await context.bot.send_message(chat_id=chat_id, text=text_resp)
 
 
 async def current(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -288,21 +736,17 @@ async def current(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     Zum Löschen nutze /delete, zum Ändern sende neue IDs.
     """
     chat_id = update.effective_chat.id
-    rank_ids = context.user_data.get("ranking_ids", [])
+    rank_ids = await get_ranking(chat_id, context)
 
     if not rank_ids:
         await context.bot.send_message(chat_id=chat_id, text="Du hast noch keine Spiele ausgewählt.")
         return
 
-    rank_names = [
-        GAMES_DF.loc[GAMES_DF["game_id"] == gid, "game_name"].values[0]
-        for gid in rank_ids
-    ]
+    rank_names = [GAME_NAME_BY_ID[gid] for gid in rank_ids]
     text = (
-        "🎮 Deine aktuelle Prioritätenliste:\n"
+        _CURRENT_HEAD
         + "\n".join(f"{i+1}. {rank_names[i]}" for i in range(len(rank_names)))
-        + "\n\n"
-        "Um sie zu ändern, sende einfach erneut deine ID-Liste."
+        + _CURRENT_TAIL
     )
     await context.bot.send_message(chat_id=chat_id, text=text)
 
@@ -310,35 +754,62 @@ async def current(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # ── HAUPTBAUSTEIN: DB INITIALISIEREN & WEBHOOK STARTEN ────────────────────────────
 
 def main() -> None:
-    # 1) Postgres-Tabelle anlegen (falls fehlt) und Spalten absichern
+    # 0) uvloop als Event-Loop verwenden, sofern installiert (Linux/Render);
+    #    reduziert Scheduling- und Syscall-Overhead der asyncio-I/O-Pfade.
+    try:
+        import uvloop
+        uvloop.install()
+        logger.info("uvloop als Event-Loop installiert.")
+    except ImportError:
+        logger.info("uvloop nicht verfügbar, Standard-asyncio-Loop wird verwendet.")
+
+    # 1) Verbindungspool aufbauen, dann Tabelle anlegen und Spalten absichern
+    init_pool()
     init_db()
 
-    # 2) Token und APP_URL aus Umgebung auslesen
-    TOKEN = os.getenv("BOT_TOKEN")
-    APP_URL = os.getenv("APP_URL")  # z.B. "https://mein-bot.onrender.com"
-    if not TOKEN or not APP_URL:
+    # 2) Beim Import gelesene Konfiguration prüfen (fail fast)
+    if not BOT_TOKEN or not APP_URL:
         logger.error("Fehlende Umgebungsvariable BOT_TOKEN oder APP_URL")
         return
 
-    app = ApplicationBuilder().token(TOKEN).build()
+    # Ausgehende Bot-API-Calls über einen größeren Keep-Alive-Pool schicken,
+    # damit parallele send_message-Aufrufe nicht auf neue TLS-Verbindungen warten.
+    request = HTTPXRequest(connection_pool_size=32, pool_timeout=1.0)
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(request)
+        # zentrale Drossel auf das Telegram-Limit von 30 Nachrichten/Sekunde
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1))
+        .post_init(start_write_worker)
+        .post_shutdown(close_pool)
+        .build()
+    )
 
     # 3) Handler registrieren
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("games", list_games))
     app.add_handler(CommandHandler("current", current))
     app.add_handler(CommandHandler("delete", delete_selection))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-
-    # 4) Webhook-Pfad und -URL
-    WEBHOOK_PATH = f"/{TOKEN}"
-    WEBHOOK_URL = f"{APP_URL}/{TOKEN}"
-
-    # 5) Bot im Webhook-Modus starten
+    # Nachrichten ohne Zahl erreichen handle_message gar nicht erst:
+    # der Dispatcher sortiert sie per Regex-Filter in den Hinweis-Handler.
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.Regex(_ID_RE), handle_message))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_unrecognized))
+
+    # 4) Webhook-Pfad und -URL: zufälliges Secret statt des Bot-Tokens in der URL.
+    #    Wird bei jedem Start neu erzeugt; setWebhook registriert es ohnehin neu.
+    secret = secrets.token_urlsafe(32)
+    WEBHOOK_URL = f"{APP_URL}/{secret}"
+
+    # 5) Bot im Webhook-Modus starten; nur Message-Updates anfordern,
+    #    damit Telegram keine unnötigen Payloads schickt.
     app.run_webhook(
         listen="0.0.0.0",
         port=int(os.environ.get("PORT", "8443")),
-        url_path=WEBHOOK_PATH,
+        url_path=secret,
         webhook_url=WEBHOOK_URL,
+        secret_token=secret,
+        allowed_updates=["message"],
     )
 
 